@@ -13,10 +13,21 @@ import re
 import sys
 import time
 import json
-from typing import Optional
-from datetime import datetime, timezone, timedelta
+import math
+import bisect
+import threading
+from typing import Callable, Iterable, Iterator, Optional
+from datetime import datetime, time as dt_time, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:  # 可选：orjson 编解码更快，未安装时回退到标准库 json
+    import orjson
+except ImportError:
+    orjson = None
 
 
 # ================== 环境变量 ==================
@@ -61,6 +72,18 @@ FIELD = {
 COST_FIELD = "持仓成本"     # Number / Formula / Rollup(number)
 WEIGHT_FIELD = "仓位"       # Number（建议 Notion 设置为百分比显示）
 
+# 查询时只返回脚本实际读取的字段（filter_properties），缩小响应体
+HOLDING_QUERY_PROPS = (
+    HOLDING_TITLE_PROP, HOLDING_CODE_PROP,
+    FIELD["dwjz"], FIELD["gsz"], FIELD["gszzl"], FIELD["gztime"], FIELD["source"],
+    COST_FIELD, WEIGHT_FIELD,
+)
+TRADE_QUERY_PROPS = (
+    TRADE_CODE_PROP, TRADE_NAME_PROP, TRADE_RELATION_PROP,
+    TRADE_HOLDING_DAYS_PROP, TRADE_QUANTITY_PROP, TRADE_AMOUNT_PROP,
+    TRADE_ESTIMATED_FEE_PROP, TRADE_HOLDING_PROFIT_PROP,
+)
+
 # ================== Notion / API ==================
 NOTION_HEADERS = {
     "Authorization": f"Bearer {NOTION_TOKEN}",
@@ -82,23 +105,126 @@ EM_F10_API = (
     "&pageIndex=1&pageSize=1&startDate=&endDate="
 )
 
+# 行情抓取并发数（fundgz / 东财均为独立的 I/O 请求）
+FETCH_WORKERS = max(1, int(os.getenv("FETCH_WORKERS") or 16))
+# Notion 写入并发数
+NOTION_WORKERS = max(1, int(os.getenv("NOTION_WORKERS") or 8))
+# 连接池容量需覆盖最大并发，否则多出的连接用完即弃
+POOL_SIZE = max(32, FETCH_WORKERS, NOTION_WORKERS)
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class _PagesRetry(Retry):
+    """/pages 的重试：POST 创建页面非幂等，只在 429（请求未被处理）时重试"""
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() == "POST":
+            return status_code == 429 and bool(self.total)
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def _build_session() -> requests.Session:
+    """共享连接池的 Session：复用 TCP/TLS 连接，并对 5xx/429 自动重试"""
+    session = requests.Session()
+    # 只放各站点通用的头；Notion 鉴权头按请求携带，避免发往行情站点
+    session.headers["User-Agent"] = UA_HEADERS["User-Agent"]
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=POOL_SIZE,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=RETRY_STATUS,
+            raise_on_status=False,
+        ),
+    )
+    # Notion 限流（429）较常见：更多次数的指数退避，遵循 Retry-After，
+    # 且 database query（POST，只读）与更新（PATCH）同样重试
+    notion_adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=POOL_SIZE,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods={"GET", "POST", "PATCH"},
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    )
+    # 页面创建若在 5xx/读超时后重试，Notion 可能已建好页面，会产生重复持仓；
+    # 因此 /pages 上 POST 不在 allowed_methods 中（读超时不重试），仅 429 重试
+    pages_adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=POOL_SIZE,
+        max_retries=_PagesRetry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=RETRY_STATUS,
+            allowed_methods={"GET", "PATCH"},
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.mount("https://api.notion.com/", notion_adapter)
+    session.mount("https://api.notion.com/v1/pages", pages_adapter)
+    return session
+
+
+_SESSION = _build_session()
+
 # ================ 工具函数 ================
 SG_TZ = timezone(timedelta(hours=8))  # Asia/Singapore
+MARKET_CLOSE = dt_time(15, 0)         # A 股收盘，此后当日估值不再变化
 
 
 def today_iso_date() -> str:
     return datetime.now(SG_TZ).date().isoformat()
 
 
+_NONDIGIT_RE = re.compile(r"\D")
+
+
 def zpad6(s: str) -> str:
-    t = "".join(ch for ch in str(s or "").strip() if ch.isdigit())
+    t = _NONDIGIT_RE.sub("", str(s or ""))
     return t.zfill(6) if t else ""
 
 
+def json_dumps(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def json_loads(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def run_concurrently(fn: Callable, items: Iterable, max_workers: int) -> list:
+    """线程池并发执行 fn(item)，按输入顺序返回结果；单项异常作为结果返回"""
+    items = list(items)
+    if not items:
+        return []
+
+    def call(item):
+        try:
+            return fn(item)
+        except Exception as exc:
+            return exc
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        return list(ex.map(call, items))
+
+
 def notion_request(method: str, path: str, payload=None) -> dict:
     url = f"https://api.notion.com/v1{path}"
-    data = json.dumps(payload) if payload is not None else None
-    resp = requests.request(
+    data = json_dumps(payload) if payload is not None else None
+    resp = _SESSION.request(
         method, url, headers=NOTION_HEADERS, data=data, timeout=25
     )
     if not resp.ok:
@@ -106,7 +232,68 @@ def notion_request(method: str, path: str, payload=None) -> dict:
             f"Notion {method} {path} failed: "
             f"{resp.status_code} {resp.text}"
         )
-    return resp.json()
+    return json_loads(resp.content)
+
+
+def notion_patch_pages(updates: list) -> list:
+    """并发 PATCH 多个页面；updates 为 [(page_id, properties)]，返回结果/异常列表"""
+    return run_concurrently(
+        lambda u: notion_request("PATCH", f"/pages/{u[0]}", {"properties": u[1]}),
+        updates,
+        NOTION_WORKERS,
+    )
+
+
+# 数据库字段名 → 属性 ID（db_id → {name: id}），每个库只查一次 schema
+_DB_PROP_IDS: dict = {}
+
+
+def database_property_ids(db_id: str, names: Iterable[str]) -> list:
+    """解析字段名对应的属性 ID；schema 获取失败时返回空列表（即不过滤）"""
+    ids = _DB_PROP_IDS.get(db_id)
+    if ids is None:
+        try:
+            schema = notion_request("GET", f"/databases/{db_id}")
+        except Exception as exc:
+            print(f"[WARN] 获取数据库结构失败 {db_id}: {exc}")
+            return []
+        ids = {
+            name: p.get("id")
+            for name, p in (schema.get("properties") or {}).items()
+            if p.get("id")
+        }
+        _DB_PROP_IDS[db_id] = ids
+    return [ids[n] for n in names if n in ids]
+
+
+def iter_database_query(
+    db_id: str, payload: dict, properties: Optional[Iterable[str]] = None
+) -> Iterator[dict]:
+    """分页查询数据库并逐条产出；处理当前页时已在后台请求下一页。
+    properties 给出时只返回这些字段（filter_properties）"""
+    path = f"/databases/{db_id}/query"
+    if properties:
+        prop_ids = database_property_ids(db_id, properties)
+        if prop_ids:
+            # 属性 ID 本身已是 URL 编码形式，直接拼接
+            path += "?" + "&".join(f"filter_properties={i}" for i in prop_ids)
+
+    def fetch(cursor: Optional[str]) -> dict:
+        body = dict(payload)
+        if cursor:
+            body["start_cursor"] = cursor
+        return notion_request("POST", path, body)
+
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        data = fetch(None)
+        while True:
+            pending = None
+            if data.get("has_more") and data.get("next_cursor"):
+                pending = ex.submit(fetch, data["next_cursor"])
+            yield from data.get("results") or []
+            if pending is None:
+                break
+            data = pending.result()
 
 
 def get_prop_text(prop: dict) -> str:
@@ -125,6 +312,18 @@ def get_prop_text(prop: dict) -> str:
     return ""
 
 
+def prop_select_name(prop: dict) -> str:
+    if not prop or prop.get("type") != "select":
+        return ""
+    return (prop.get("select") or {}).get("name") or ""
+
+
+def prop_date_start(prop: dict) -> str:
+    if not prop or prop.get("type") != "date":
+        return ""
+    return (prop.get("date") or {}).get("start") or ""
+
+
 def has_relation(prop: dict) -> bool:
     if not prop or prop.get("type") != "relation":
         return False
@@ -142,113 +341,149 @@ def to_float_safe(x) -> Optional[float]:
         return None
 
 
+_ISO_RE = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?$")
+
+
 def is_iso_like(s: str) -> bool:
-    return bool(
-        re.match(r"^\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2})?)?$", s or "")
-    )
+    return bool(s) and _ISO_RE.match(s) is not None
 
 
 def get_page_properties(page_id: str) -> dict:
     return notion_request("GET", f"/pages/{page_id}")
 
 
+# 持仓页属性缓存（page_id → properties），单次运行内复用，避免重复 GET
+_HOLDING_PROPS_CACHE: dict = {}
+
+
+def cache_holding_pages(pages: list) -> None:
+    for pg in pages:
+        _HOLDING_PROPS_CACHE[pg["id"]] = pg.get("properties") or {}
+
+
+def get_holding_props(holding_page_id: str) -> dict:
+    props = _HOLDING_PROPS_CACHE.get(holding_page_id)
+    if props is None:
+        props = get_page_properties(holding_page_id).get("properties") or {}
+        _HOLDING_PROPS_CACHE[holding_page_id] = props
+    return props
+
+
 # ================ fundgz（名称/行情） ================
 def http_get_utf8(url: str, timeout: float = 8.0) -> str:
-    resp = requests.get(
-        url, headers={"User-Agent": "Mozilla/5.0"}, timeout=timeout
-    )
+    resp = _SESSION.get(url, timeout=timeout)
     resp.raise_for_status()
     return resp.content.decode("utf-8", errors="replace")
 
 
-def fetch_fund_name_from_fundgz(code6: str) -> Optional[str]:
-    for base in (FUNDGZ_HTTP, FUNDGZ_HTTPS):
-        try:
-            raw = http_get_utf8(
-                base.format(code=code6) + f"?rt={int(time.time())}"
-            )
-            m = re.search(r"\{.*\}", raw, flags=re.S)
-            if not m:
-                continue
-            js = m.group(0)
-            mm = re.search(r'"name"\s*:\s*"([^"]+)"', js)
-            if mm:
-                return mm.group(1).strip()
-        except Exception:
-            time.sleep(0.2)
-            continue
-    return None
+def parse_fundgz_jsonp(raw: str) -> dict:
+    """解析 fundgz 返回的 jsonpgz({...}); 负载，失败返回空 dict"""
+    start = raw.find("{")
+    end = raw.rfind("}") + 1
+    if start < 0 or end <= start:
+        return {}
+    try:
+        obj = json_loads(raw[start:end])
+    except ValueError:
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+
+# fundgz 行情缓存（code6 → (抓取时刻, info)），TTL 内的重复请求直接复用
+FUNDGZ_CACHE_TTL = 60.0
+_FUNDGZ_CACHE: dict = {}
 
 
 def fetch_fundgz(code6: str, timeout: float = 8.0) -> dict:
-    for base in (FUNDGZ_HTTP, FUNDGZ_HTTPS):
-        try:
-            raw = http_get_utf8(
-                base.format(code=code6) + f"?rt={int(time.time())}", timeout
-            )
-            m = re.search(r"\{.*\}", raw, flags=re.S)
-            if not m:
-                continue
-            js = m.group(0)
-
-            def jget(k: str) -> str:
-                mm = re.search(rf'"{k}"\s*:\s*"([^"]*)"', js)
-                return mm.group(1) if mm else ""
-
-            name = jget("name")
-            dwjz = jget("dwjz")
-            gsz = jget("gsz")
-            gszzl = normalize_num_str(jget("gszzl"))
-            gz = jget("gztime")
-            if gz and not is_iso_like(gz):
-                gz = ""
-            return {
-                "name": name,
-                "dwjz": dwjz,
-                "gsz": gsz,
-                "gszzl": gszzl,
-                "gztime": gz,
-                "source": "天天基金",
-            }
-        except Exception:
-            time.sleep(0.3)
-            continue
-    return {}
+    hit = _FUNDGZ_CACHE.get(code6)
+    if hit and time.monotonic() - hit[0] < FUNDGZ_CACHE_TTL:
+        return hit[1]
+    info = _fetch_fundgz_uncached(code6, timeout)
+    if info:
+        _FUNDGZ_CACHE[code6] = (time.monotonic(), info)
+    return info
+
+
+_FUND_NAME_CACHE: dict = {}
+
+
+def fetch_fund_name_from_fundgz(code6: str) -> Optional[str]:
+    """基金名称；与行情共用同一次 fundgz 请求，只缓存取到的名称（失败下次重试）"""
+    name = _FUND_NAME_CACHE.get(code6)
+    if name:
+        return name
+    name = str(fetch_fundgz(code6).get("name") or "").strip()
+    if name:
+        _FUND_NAME_CACHE[code6] = name
+    return name or None
+
+
+def http_get_fundgz(code6: str, timeout: float) -> str:
+    """fundgz 走 HTTPS（keep-alive 复用连接）；仅连接/TLS 失败时退回 HTTP"""
+    # rt 参数防止 CDN/代理返回过期的盘中估值；进程内去重由 _FUNDGZ_CACHE 负责
+    query = f"?rt={int(time.time())}"
+    try:
+        return http_get_utf8(FUNDGZ_HTTPS.format(code=code6) + query, timeout)
+    except requests.exceptions.ConnectionError:  # 含 SSLError
+        return http_get_utf8(FUNDGZ_HTTP.format(code=code6) + query, timeout)
+
+
+def _fetch_fundgz_uncached(code6: str, timeout: float) -> dict:
+    # 5xx/429 已由 Session 的 Retry 退避重试；这里只把最终的网络失败视为「无数据」
+    try:
+        obj = parse_fundgz_jsonp(http_get_fundgz(code6, timeout))
+    except requests.RequestException:
+        return {}
+    if not obj:
+        return {}
+    name = str(obj.get("name") or "")
+    dwjz = str(obj.get("dwjz") or "")
+    gsz = str(obj.get("gsz") or "")
+    gszzl = normalize_num_str(str(obj.get("gszzl") or ""))
+    gz = str(obj.get("gztime") or "")
+    if gz and not is_iso_like(gz):
+        gz = ""
+    return {
+        "name": name,
+        "dwjz": dwjz,
+        "gsz": gsz,
+        "gszzl": gszzl,
+        "gztime": gz,
+        "source": "天天基金",
+    }
 
 
 # ================ 东方财富 F10（兜底） ================
 def fetch_em_last_nav_and_chg(code6: str, timeout: float = 8.0) -> dict:
     try:
         url = EM_F10_API.format(code=code6)
-        resp = requests.get(url, headers=UA_HEADERS, timeout=timeout)
+        resp = _SESSION.get(url, headers=UA_HEADERS, timeout=timeout)
         resp.raise_for_status()
-        js = resp.json()
-        rows = (js.get("Data") or {}).get("LSJZList") or []
-        if not rows:
-            return {}
-        row = rows[0]
-        return {
-            "dwjz": row.get("DWJZ"),
-            "gszzl": row.get("JZZZL"),
-            "gztime": row.get("FSRQ"),
-            "source": "东方财富(历史净值)",
-        }
-    except Exception:
+        js = json_loads(resp.content)
+    except (requests.RequestException, ValueError):
+        return {}
+    rows = ((js or {}).get("Data") or {}).get("LSJZList") or []
+    if not rows:
         return {}
+    row = rows[0]
+    return {
+        "dwjz": row.get("DWJZ"),
+        "gszzl": row.get("JZZZL"),
+        "gztime": row.get("FSRQ"),
+        "source": "东方财富(历史净值)",
+    }
 
 
 # ================ 持仓 查找/创建/标题补全 ================
-def find_holding_by_code(code6: str) -> Optional[str]:
-    payload = {
-        "filter": {
-            "property": HOLDING_CODE_PROP,
-            "rich_text": {"equals": code6},
-        },
-        "page_size": 1,
-    }
-    data = notion_request("POST", f"/databases/{HOLDINGS_DB_ID}/query", payload)
-    res = data.get("results") or []
-    return res[0]["id"] if res else None
+def index_holdings_by_code(pages: list) -> dict:
+    """持仓页按 6 位代码建立索引：code6 → page_id"""
+    index = {}
+    for pg in pages:
+        props = pg.get("properties") or {}
+        code6 = zpad6(get_prop_text(props.get(HOLDING_CODE_PROP)))
+        if code6 and code6 not in index:
+            index[code6] = pg["id"]
+    return index
 
 
 def create_holding(code6: str, name: str) -> str:
@@ -261,306 +496,305 @@ def create_holding(code6: str, name: str) -> str:
         "/pages",
         {"parent": {"database_id": HOLDINGS_DB_ID}, "properties": props},
     )
+    cache_holding_pages([data])
     return data["id"]
 
 
 def get_holding_title(holding_page_id: str) -> str:
-    props = get_page_properties(holding_page_id).get("properties") or {}
+    props = get_holding_props(holding_page_id)
     return get_prop_text(props.get(HOLDING_TITLE_PROP)) or ""
 
 
 def update_holding_title_if_needed(
-    holding_page_id: str, code6: str, fetched_name: Optional[str] = None
-) -> None:
-    cur = get_holding_title(holding_page_id)
+    holding_page_id: str,
+    code6: str,
+    current_title: Optional[str] = None,
+    fetched_name: Optional[str] = None,
+) -> str:
+    """标题为空或仅为代码时补全为基金名称，返回最终标题"""
+    if current_title is None:
+        current_title = get_holding_title(holding_page_id)
+    cur = current_title
     need = (not cur) or cur.isdigit() or (cur == code6)
     if not need:
-        return
+        return cur
     name = fetched_name or fetch_fund_name_from_fundgz(code6) or code6
-    notion_request(
+    if name == cur:
+        # 取不到名称时回退为代码，与现有标题相同则不再 PATCH
+        return cur
+    data = notion_request(
         "PATCH",
         f"/pages/{holding_page_id}",
         {"properties": {HOLDING_TITLE_PROP: {
             "title": [{"text": {"content": name}}]
         }}},
     )
+    cache_holding_pages([data])
+    return name
 
 
 # ================ 交易：Relation / 名称写入 ================
-def set_trade_relation(trade_page_id: str, holding_page_id: str) -> None:
-    notion_request(
-        "PATCH",
-        f"/pages/{trade_page_id}",
-        {"properties": {TRADE_RELATION_PROP: {
-            "relation": [{"id": holding_page_id}]
-        }}},
-    )
+# 以下均只构造 properties，由调用方合并后一次 PATCH
+def trade_relation_props(holding_page_id: str) -> dict:
+    return {TRADE_RELATION_PROP: {"relation": [{"id": holding_page_id}]}}
 
 
-def set_trade_name(trade_page_id: str, name: str) -> None:
+def trade_name_props(trade_props: dict, name: str) -> dict:
     if not name:
-        return
-    pg = get_page_properties(trade_page_id)
-    p = (pg.get("properties") or {}).get(TRADE_NAME_PROP)
+        return {}
+    p = trade_props.get(TRADE_NAME_PROP)
     if not p:
-        return
+        return {}
     t = p.get("type")
     if t == "title":
-        payload = {TRADE_NAME_PROP: {"title": [{"text": {"content": name}}]}}
-    elif t == "rich_text":
-        payload = {
-            TRADE_NAME_PROP: {"rich_text": [{"text": {"content": name}}]}
-        }
-    else:
-        return
-    notion_request("PATCH", f"/pages/{trade_page_id}", {"properties": payload})
+        return {TRADE_NAME_PROP: {"title": [{"text": {"content": name}}]}}
+    if t == "rich_text":
+        return {TRADE_NAME_PROP: {"rich_text": [{"text": {"content": name}}]}}
+    return {}
+
 
+# 卖出费率阶梯：持仓天数 [0, 7) → 1.5%，[7, 30) → 0.5%，≥30 → 0%（负数视为 0%）
+SELL_FEE_DAY_THRESHOLDS = (0, 7, 30)
+SELL_FEE_RATES = (0.0, 0.015, 0.005, 0.0)
 
 
 def calculate_sell_fee_rate(holding_days: float) -> float:
     """根据持仓时间计算卖出费率"""
-    if holding_days < 0:
-        return 0.0
-    elif holding_days < 7:
-        return 0.015  # 1.5%
-    elif holding_days < 30:
-        return 0.005  # 0.5%
-    else:
-        return 0.0    # 0%
+    return SELL_FEE_RATES[bisect.bisect_right(SELL_FEE_DAY_THRESHOLDS, holding_days)]
 
 
-def get_estimated_nav_from_holding(holding_page_id: str) -> float:
-    """从持仓表获取估算净值"""
-    try:
-        props = get_page_properties(holding_page_id).get("properties") or {}
-        # 优先使用估算净值，如果没有则使用单位净值
-        estimated_nav = prop_number_value(props.get(FIELD["gsz"]))
-        if estimated_nav is None:
-            estimated_nav = prop_number_value(props.get(FIELD["dwjz"]))
-        return estimated_nav or 0.0
-    except Exception:
-        return 0.0
+def get_estimated_nav_from_holding(holding_props: dict) -> float:
+    """从持仓页属性获取估算净值"""
+    # 优先使用估算净值，如果没有则使用单位净值
+    estimated_nav = prop_number_value(holding_props.get(FIELD["gsz"]))
+    if estimated_nav is None:
+        estimated_nav = prop_number_value(holding_props.get(FIELD["dwjz"]))
+    return estimated_nav or 0.0
 
 
-def calculate_estimated_sell_fee(trade_page_id: str, holding_page_id: str) -> None:
-    """计算预估卖出费率并更新到交易记录"""
+def trade_metrics_props(
+    trade_page_id: str, trade_props: dict, holding_page_id: str, holding_props: dict
+) -> dict:
+    """计算预估卖出费率与持有收益（共用份额、净值），返回算得出的 properties"""
+    out = {}
     try:
-        trade_props = get_page_properties(trade_page_id).get("properties") or {}
-        
-        # 获取持仓时间（Formula 字段）
-        holding_days_prop = trade_props.get(TRADE_HOLDING_DAYS_PROP)
-        if not holding_days_prop or holding_days_prop.get("type") != "formula":
-            print(f"[WARN] 交易 {trade_page_id} 缺少持仓时间字段")
-            return
-            
-        holding_days = prop_number_value(holding_days_prop)
-        if holding_days is None:
-            print(f"[WARN] 交易 {trade_page_id} 持仓时间计算失败")
-            return
-            
         # 获取持仓份额
         quantity_prop = trade_props.get(TRADE_QUANTITY_PROP)
         if not quantity_prop:
             print(f"[WARN] 交易 {trade_page_id} 缺少持仓份额字段")
-            return
+            return out
             
         quantity = prop_number_value(quantity_prop)
         if quantity is None or quantity <= 0:
             print(f"[WARN] 交易 {trade_page_id} 持仓份额无效: {quantity}")
-            return
+            return out
             
         # 获取估算净值
-        estimated_nav = get_estimated_nav_from_holding(holding_page_id)
+        estimated_nav = get_estimated_nav_from_holding(holding_props)
         if estimated_nav <= 0:
             print(f"[WARN] 持仓 {holding_page_id} 估算净值无效: {estimated_nav}")
-            return
-            
-        # 计算卖出费率
-        sell_fee_rate = calculate_sell_fee_rate(holding_days)
-        
-        # 计算预估卖出费率
-        estimated_sell_fee = sell_fee_rate * quantity * estimated_nav
-        
-        # 更新交易记录
-        notion_request(
-            "PATCH",
-            f"/pages/{trade_page_id}",
-            {"properties": {TRADE_ESTIMATED_FEE_PROP: {"number": estimated_sell_fee}}}
-        )
-        
-        print(f"[FEE] 交易 {trade_page_id} 预估卖出费率: {estimated_sell_fee:.2f} "
-              f"(费率:{sell_fee_rate*100:.1f}%, 份额:{quantity}, 净值:{estimated_nav:.4f})")
-              
-    except Exception as exc:
-        print(f"[ERR] 计算预估卖出费率失败 {trade_page_id}: {exc}")
+            return out
 
-
-def calculate_holding_profit(trade_page_id: str, holding_page_id: str) -> None:
-    """计算持有收益并更新到交易记录"""
-    try:
-        trade_props = get_page_properties(trade_page_id).get("properties") or {}
-        
-        # 获取持仓份额
-        quantity_prop = trade_props.get(TRADE_QUANTITY_PROP)
-        if not quantity_prop:
-            print(f"[WARN] 交易 {trade_page_id} 缺少持仓份额字段")
-            return
+        market_value = quantity * estimated_nav
             
-        quantity = prop_number_value(quantity_prop)
-        if quantity is None or quantity <= 0:
-            print(f"[WARN] 交易 {trade_page_id} 持仓份额无效: {quantity}")
-            return
-            
-        # 获取交易金额
+        # 预估卖出费率 = 卖出费率 × 持仓份额 × 估算净值（持仓时间为 Formula 字段）
+        holding_days_prop = trade_props.get(TRADE_HOLDING_DAYS_PROP)
+        holding_days = None
+        if not holding_days_prop or holding_days_prop.get("type") != "formula":
+            print(f"[WARN] 交易 {trade_page_id} 缺少持仓时间字段")
+        else:
+            holding_days = prop_number_value(holding_days_prop)
+            if holding_days is None:
+                print(f"[WARN] 交易 {trade_page_id} 持仓时间计算失败")
+        if holding_days is not None:
+            sell_fee_rate = calculate_sell_fee_rate(holding_days)
+            estimated_sell_fee = sell_fee_rate * market_value
+            out[TRADE_ESTIMATED_FEE_PROP] = {"number": estimated_sell_fee}
+            print(f"[FEE] 交易 {trade_page_id} 预估卖出费率: {estimated_sell_fee:.2f} "
+                  f"(费率:{sell_fee_rate*100:.1f}%, 份额:{quantity}, 净值:{estimated_nav:.4f})")
+
+        # 持有收益 = 持仓份额 × 估算净值 - 交易金额
         amount_prop = trade_props.get(TRADE_AMOUNT_PROP)
+        trade_amount = prop_number_value(amount_prop) if amount_prop else None
         if not amount_prop:
             print(f"[WARN] 交易 {trade_page_id} 缺少交易金额字段")
-            return
-            
-        trade_amount = prop_number_value(amount_prop)
-        if trade_amount is None:
+        elif trade_amount is None:
             print(f"[WARN] 交易 {trade_page_id} 交易金额无效: {trade_amount}")
-            return
-            
-        # 获取估算净值
-        estimated_nav = get_estimated_nav_from_holding(holding_page_id)
-        if estimated_nav <= 0:
-            print(f"[WARN] 持仓 {holding_page_id} 估算净值无效: {estimated_nav}")
-            return
-            
-        # 计算持有收益 = 持仓份额 × 估算净值 - 交易金额
-        holding_profit = (quantity * estimated_nav) - trade_amount
-        
-        # 更新交易记录
-        notion_request(
-            "PATCH",
-            f"/pages/{trade_page_id}",
-            {"properties": {TRADE_HOLDING_PROFIT_PROP: {"number": holding_profit}}}
-        )
-        
-        print(f"[PROFIT] 交易 {trade_page_id} 持有收益: {holding_profit:.2f} "
-              f"(份额:{quantity}, 净值:{estimated_nav:.4f}, 金额:{trade_amount:.2f})")
+        else:
+            holding_profit = market_value - trade_amount
+            out[TRADE_HOLDING_PROFIT_PROP] = {"number": holding_profit}
+            print(f"[PROFIT] 交易 {trade_page_id} 持有收益: {holding_profit:.2f} "
+                  f"(份额:{quantity}, 净值:{estimated_nav:.4f}, 金额:{trade_amount:.2f})")
               
     except Exception as exc:
-        print(f"[ERR] 计算持有收益失败 {trade_page_id}: {exc}")
+        print(f"[ERR] 计算预估卖出费率/持有收益失败 {trade_page_id}: {exc}")
+    # 只写交易表中存在的输出列：缺列会让合并的 PATCH（含关联）整体 400
+    return {k: v for k, v in out.items() if k in trade_props}
+
+
+def update_all_trades_estimated_fees(only_stale: bool = False) -> None:
+    """更新交易记录的预估卖出费率和持有收益（only_stale：只处理缺值或今天编辑过的交易）"""
+    # 只用交易表中实际存在的输出列：按缺失的字段名过滤会被 Notion 以 400 拒绝
+    outputs = [
+        n for n in (TRADE_ESTIMATED_FEE_PROP, TRADE_HOLDING_PROFIT_PROP)
+        if database_property_ids(TRADES_DB_ID, [n])
+    ]
+    schema_known = TRADES_DB_ID in _DB_PROP_IDS
+    if schema_known and not outputs:
+        print("[WARN] 交易表缺少预估卖出费率/持有收益字段，跳过费率计算")
+        return
 
+    # 一次性拉取持仓表，刷新缓存（行情可能已在本次运行中更新）
+    _HOLDING_PROPS_CACHE.clear()
+    cache_holding_pages(list_holdings_pages())
 
-def update_all_trades_estimated_fees() -> None:
-    """更新所有交易记录的预估卖出费率和持有收益"""
-    cursor = None
-    total = updated = failed = 0
-    
-    while True:
-        payload = {"page_size": 50}
-        if cursor:
-            payload["start_cursor"] = cursor
-            
-        # 查找所有有持仓关联的交易记录
-        flt = {
-            "and": [
-                {"property": TRADE_RELATION_PROP, "relation": {"is_not_empty": True}},
-                {"property": TRADE_QUANTITY_PROP, "number": {"greater_than": 0}},
-            ]
-        }
-        payload["filter"] = flt
+    total = failed = 0
+    updates = []
+
+    # 查找所有有持仓关联的交易记录
+    flt = {
+        "and": [
+            {"property": TRADE_RELATION_PROP, "relation": {"is_not_empty": True}},
+            {"property": TRADE_QUANTITY_PROP, "number": {"greater_than": 0}},
+        ]
+    }
+    # 注意：持仓时间是公式，按天增长却不改变 last_edited_time，跨越 7/30 天
+    # 费率档位的交易在 only_stale 下不会被选中；由每日定时的 all 模式全量重算
+    if only_stale and schema_known:
+        stale = [{"property": n, "number": {"is_empty": True}} for n in outputs]
+        stale.append({
+            "timestamp": "last_edited_time",
+            "last_edited_time": {"on_or_after": today_iso_date()},
+        })
+        flt["and"].append({"or": stale})
+    payload = {"page_size": 100, "filter": flt}
+    skipped = 0
+    for pg in iter_database_query(TRADES_DB_ID, payload, TRADE_QUERY_PROPS):
+        total += 1
+        trade_id = pg["id"]
+        props = pg.get("properties") or {}
         
-        data = notion_request("POST", f"/databases/{TRADES_DB_ID}/query", payload)
-        for pg in data.get("results") or []:
-            total += 1
-            trade_id = pg["id"]
-            props = pg.get("properties") or {}
+        # 获取持仓关联
+        relation_prop = props.get(TRADE_RELATION_PROP)
+        if not relation_prop or relation_prop.get("type") != "relation":
+            continue
             
-            # 获取持仓关联
-            relation_prop = props.get(TRADE_RELATION_PROP)
-            if not relation_prop or relation_prop.get("type") != "relation":
-                continue
-                
-            relations = relation_prop.get("relation") or []
-            if not relations:
-                continue
-                
-            holding_id = relations[0]["id"]
+        relations = relation_prop.get("relation") or []
+        if not relations:
+            continue
             
-            # 计算预估卖出费率和持有收益
-            try:
-                calculate_estimated_sell_fee(trade_id, holding_id)
-                calculate_holding_profit(trade_id, holding_id)
-                updated += 1
-            except Exception as exc:
-                print(f"[ERR] 更新交易数据失败 {trade_id}: {exc}")
-                failed += 1
-                
-        cursor = data.get("next_cursor")
-        if not data.get("has_more"):
-            break
+        holding_id = relations[0]["id"]
+        
+        # 计算预估卖出费率和持有收益，合并为一次 PATCH
+        try:
+            holding_props = get_holding_props(holding_id)
+        except Exception as exc:
+            print(f"[ERR] 更新交易数据失败 {trade_id}: {exc}")
+            failed += 1
+            continue
+        metrics = trade_metrics_props(trade_id, props, holding_id, holding_props)
+        if not metrics:
+            continue
+        # 只写入与现有值不同的字段
+        changed = {
+            k: v for k, v in metrics.items()
+            if not number_unchanged(props.get(k), v["number"])
+        }
+        if changed:
+            updates.append((trade_id, changed))
+        else:
+            skipped += 1
+
+    # 每条交易相互独立，并发写入
+    updated = 0
+    for (trade_id, _), res in zip(updates, notion_patch_pages(updates)):
+        if isinstance(res, Exception):
+            print(f"[ERR] 更新交易数据失败 {trade_id}: {res}")
+            failed += 1
+        else:
+            updated += 1
             
-    print(f"TRADES UPDATE Done. total={total}, updated={updated}, failed={failed}")
+    print(
+        f"TRADES UPDATE Done. total={total}, updated={updated}, "
+        f"unchanged={skipped}, failed={failed}"
+    )
 
 
 # ================ 交易处理：建立/补齐关系与名称（支持--today-only） ================
 def process_new_trades(today_only: bool = False) -> None:
-    cursor = None
+    # 一次性拉取持仓表并按代码建立索引，避免逐笔查询
+    holdings = list_holdings_pages()
+    cache_holding_pages(holdings)
+    holdings_by_code = index_holdings_by_code(holdings)
+
     processed = created = linked = named = 0
+    pending = []
 
-    while True:
-        payload = {"page_size": 50}
-        if cursor:
-            payload["start_cursor"] = cursor
+    flt = {
+        "and": [
+            {"property": TRADE_CODE_PROP, "rich_text": {"is_not_empty": True}},
+            {"property": TRADE_RELATION_PROP, "relation": {"is_empty": True}},
+        ]
+    }
+    if today_only:
+        flt["and"].append({
+            "timestamp": "created_time",
+            "created_time": {"on_or_after": today_iso_date()},
+        })
+    payload = {"page_size": 100, "filter": flt}
+
+    for pg in iter_database_query(TRADES_DB_ID, payload, TRADE_QUERY_PROPS):
+        processed += 1
+        props = pg.get("properties") or {}
+        trade_id = pg["id"]
+        code6 = zpad6(get_prop_text(props.get(TRADE_CODE_PROP)))
+        if not code6:
+            continue
 
-        flt = {
-            "and": [
-                {"property": TRADE_CODE_PROP, "rich_text": {"is_not_empty": True}},
-                {"property": TRADE_RELATION_PROP, "relation": {"is_empty": True}},
-            ]
-        }
-        if today_only:
-            flt["and"].append({
-                "timestamp": "created_time",
-                "created_time": {"on_or_after": today_iso_date()},
-            })
-        payload["filter"] = flt
-
-        data = notion_request("POST", f"/databases/{TRADES_DB_ID}/query", payload)
-        for pg in data.get("results") or []:
-            processed += 1
-            props = pg.get("properties") or {}
-            trade_id = pg["id"]
-            code6 = zpad6(get_prop_text(props.get(TRADE_CODE_PROP)))
-            if not code6:
-                continue
-
-            holding_id = find_holding_by_code(code6)
-            fetched_name = None
-            if not holding_id:
+        # 单笔解析失败只跳过该交易，已解析的交易仍在下方写入
+        try:
+            holding_id = holdings_by_code.get(code6)
+            if holding_id:
+                # 已有持仓：当前标题取自已拉取的属性，为空/为代码时补全
+                fetched_name = update_holding_title_if_needed(
+                    holding_id, code6, current_title=get_holding_title(holding_id)
+                )
+            else:
+                # 新建持仓时已写入名称，无需再检查标题
                 fetched_name = fetch_fund_name_from_fundgz(code6) or code6
                 holding_id = create_holding(code6, fetched_name)
+                holdings_by_code[code6] = holding_id
                 created += 1
 
-            update_holding_title_if_needed(holding_id, code6, fetched_name)
-            set_trade_relation(trade_id, holding_id)
-            linked += 1
+            # 关联、名称、预估卖出费率和持有收益合并为一次 PATCH
+            trade_update = trade_relation_props(holding_id)
+            name_props = trade_name_props(props, fetched_name)
+            trade_update.update(name_props)
+            trade_update.update(trade_metrics_props(
+                trade_id, props, holding_id, get_holding_props(holding_id)
+            ))
+        except Exception as exc:
+            print(f"[ERR] trade {trade_id} (code={code6}): {exc}")
+            continue
+        pending.append(
+            (trade_id, holding_id, code6, fetched_name, bool(name_props), trade_update)
+        )
 
-            if not fetched_name:
-                fetched_name = (
-                    get_holding_title(holding_id)
-                    or fetch_fund_name_from_fundgz(code6)
-                    or code6
-                )
-            set_trade_name(trade_id, fetched_name)
+    # 持仓已在上面逐笔解析/创建完毕，各交易的写入相互独立，并发 PATCH
+    updates = [(item[0], item[-1]) for item in pending]
+    for (trade_id, holding_id, code6, name, has_name, _), res in zip(
+        pending, notion_patch_pages(updates)
+    ):
+        if isinstance(res, Exception):
+            print(f"[ERR] trade {trade_id} (code={code6}): {res}")
+            continue
+        linked += 1
+        if has_name:
             named += 1
-            
-            # 计算预估卖出费率和持有收益
-            calculate_estimated_sell_fee(trade_id, holding_id)
-            calculate_holding_profit(trade_id, holding_id)
-
-            print(
-                f"[OK] trade {trade_id} -> holding {holding_id} "
-                f"(code={code6}, name={fetched_name})"
-            )
-
-        cursor = data.get("next_cursor")
-        if not data.get("has_more"):
-            break
+        print(
+            f"[OK] trade {trade_id} -> holding {holding_id} "
+            f"(code={code6}, name={name})"
+        )
 
     print(
         "TRADES Done. processed={p}, created_holdings={c}, "
@@ -572,22 +806,12 @@ def process_new_trades(today_only: bool = False) -> None:
 
 # ================ 行情更新（持仓表） ================
 def list_holdings_pages() -> list:
-    pages = []
-    cursor = None
-    while True:
-        payload = {"page_size": 100}
-        if cursor:
-            payload["start_cursor"] = cursor
-        data = notion_request("POST", f"/databases/{HOLDINGS_DB_ID}/query", payload)
-        pages.extend(data.get("results") or [])
-        cursor = data.get("next_cursor")
-        if not data.get("has_more"):
-            break
-    return pages
+    return list(iter_database_query(
+        HOLDINGS_DB_ID, {"page_size": 100}, HOLDING_QUERY_PROPS
+    ))
 
 
-def build_market_props(code: str, name: str, info: dict) -> dict:
-    now_iso = datetime.now(SG_TZ).isoformat()
+def build_market_props(code: str, name: str, info: dict, now_iso: str) -> dict:
     props = {
         FIELD["title"]: {"title": [{"text": {"content": name or code}}]},
         FIELD["code"]: {"rich_text": [{"text": {"content": code}}]},
@@ -603,9 +827,75 @@ def build_market_props(code: str, name: str, info: dict) -> dict:
     return props
 
 
+def market_unchanged(props: dict, code: str, name: str, info: dict) -> bool:
+    """持仓页现有行情与本次结果一致（不含「更新于」）时返回 True"""
+    if get_prop_text(props.get(FIELD["title"])) != (name or code):
+        return False
+    if get_prop_text(props.get(FIELD["code"])) != code:
+        return False
+    for k in ("dwjz", "gsz", "gszzl"):
+        if prop_number_value(props.get(FIELD[k])) != to_float_safe(info.get(k)):
+            return False
+    if prop_select_name(props.get(FIELD["source"])) != (info.get("source") or "失败"):
+        return False
+    gz = (info.get("gztime") or "").strip()
+    if gz and is_iso_like(gz):
+        # Notion 回读的日期可能带秒与时区，只比到分钟
+        cur = prop_date_start(props.get(FIELD["gztime"]))[:16].replace("T", " ")
+        if cur != gz[:16].replace("T", " "):
+            return False
+    return True
+
+
+def parse_notion_datetime(s: str) -> Optional[datetime]:
+    """按写入时的墙钟时间解析 Notion 日期（到分钟，忽略回读附加的时区）"""
+    # 估值时间按 fundgz 原样（北京时间、无时区）写入，Notion 可能回读为
+    # "2026-10-15T11:30:00.000+00:00"；若按时区换算会变成 19:30，
+    # 因此与 market_unchanged 一样只取前 16 位的日期与时分
+    if not s:
+        return None
+    try:
+        return datetime.fromisoformat(s[:16].replace(" ", "T"))
+    except ValueError:
+        return None
+
+
+def quote_final_today(props: dict, today: str) -> bool:
+    """持仓页已是今天收盘后的天天基金估值（当日不会再变），可跳过抓取"""
+    if prop_select_name(props.get(FIELD["source"])) != "天天基金":
+        return False
+    dt = parse_notion_datetime(prop_date_start(props.get(FIELD["gztime"])))
+    return (
+        dt is not None
+        and dt.date().isoformat() == today
+        and dt.time() >= MARKET_CLOSE
+    )
+
+
+def fetch_quote(code6: str) -> dict:
+    """fundgz 优先，缺涨跌幅时用东财 F10 兜底"""
+    info = fetch_fundgz(code6)
+    if not info or not info.get("gszzl"):
+        em = fetch_em_last_nav_and_chg(code6)
+        if em:
+            info = {
+                "name": info.get("name") if info else "",
+                "dwjz": em.get("dwjz"),
+                "gsz": em.get("dwjz"),
+                "gszzl": em.get("gszzl"),
+                "gztime": em.get("gztime"),
+                "source": em.get("source"),
+            }
+    if not (info.get("dwjz") or info.get("gszzl")):
+        info = {"source": "失败"}
+    return info
+
+
 def update_holdings_market() -> None:
     pages = list_holdings_pages()
-    total = ok = fail = 0
+    today = today_iso_date()
+    targets = []
+    fresh = 0
     for pg in pages:
         props = pg.get("properties") or {}
         code_raw = (
@@ -615,41 +905,62 @@ def update_holdings_market() -> None:
         code6 = zpad6(code_raw)
         if not code6:
             continue
-        total += 1
+        # 今日收盘后的估值已写入，重复运行无需再抓
+        if quote_final_today(props, today):
+            fresh += 1
+            continue
+        targets.append((pg, code6))
+    total = len(targets) + fresh
+    # 本批次共用同一个「更新于」时间
+    now_iso = datetime.now(SG_TZ).isoformat()
+    notion_slots = threading.BoundedSemaphore(NOTION_WORKERS)
 
-        info = fetch_fundgz(code6)
-        if not info or not info.get("gszzl"):
-            em = fetch_em_last_nav_and_chg(code6)
-            if em:
-                info = {
-                    "name": info.get("name") if info else "",
-                    "dwjz": em.get("dwjz"),
-                    "gsz": em.get("dwjz"),
-                    "gszzl": em.get("gszzl"),
-                    "gztime": em.get("gztime"),
-                    "source": em.get("source"),
-                }
-        if not (info.get("dwjz") or info.get("gszzl")):
+    # 每只基金「抓行情 → 写 Notion」作为一个单元放进线程池，
+    # 先抓完的基金立即写入，与其余基金的抓取重叠；写入并发受 NOTION_WORKERS 限制
+    def sync_one(target) -> tuple:
+        pg, code6 = target
+        try:
+            info = fetch_quote(code6)
+        except Exception as exc:
+            print(f"[WARN] MARKET {code6} 行情解析异常: {exc}")
             info = {"source": "失败"}
-
+        props = pg.get("properties") or {}
         name_existing = get_prop_text(props.get(FIELD["title"]))
         name = (info.get("name") or name_existing or code6).strip()
-        try:
+        # 与现有值一致则跳过写入（同一估值时间内的重复运行）
+        if market_unchanged(props, code6, name, info):
+            return name, info, False
+        with notion_slots:
             notion_request(
                 "PATCH",
                 f"/pages/{pg['id']}",
-                {"properties": build_market_props(code6, name, info)},
-            )
-            print(
-                f"[MARKET] {code6} {name} ｜source={info.get('source')} "
-                f"｜chg={info.get('gszzl')}"
+                {"properties": build_market_props(code6, name, info, now_iso)},
             )
-            ok += 1
-        except Exception as exc:
-            print(f"[ERR] MARKET {code6}: {exc}")
+        return name, info, True
+
+    ok = skipped = fail = 0
+    for (_, code6), res in zip(
+        targets, run_concurrently(sync_one, targets, FETCH_WORKERS)
+    ):
+        if isinstance(res, Exception):
+            print(f"[ERR] MARKET {code6}: {res}")
             fail += 1
+            continue
+        name, info, written = res
+        if not written:
+            print(f"[MARKET] {code6} {name} ｜unchanged, skip")
+            skipped += 1
+            continue
+        print(
+            f"[MARKET] {code6} {name} ｜source={info.get('source')} "
+            f"｜chg={info.get('gszzl')}"
+        )
+        ok += 1
 
-    print(f"MARKET Done. updated={ok}, failed={fail}, total={total}")
+    print(
+        f"MARKET Done. updated={ok}, skipped={skipped}, fresh={fresh}, "
+        f"failed={fail}, total={total}"
+    )
 
 
 # ================ 仓位计算（基于持仓成本） ================
@@ -670,36 +981,48 @@ def prop_number_value(prop: dict) -> Optional[float]:
     return None
 
 
+def number_unchanged(prop: dict, value: float) -> bool:
+    cur = prop_number_value(prop)
+    return cur is not None and math.isclose(cur, value, rel_tol=1e-9, abs_tol=1e-12)
+
+
 def update_positions_by_cost() -> None:
     pages = list_holdings_pages()
 
-    # 1) 计算总持仓成本
+    # 1) 单次遍历：收集成本与当前仓位，fsum 求总成本（C 层求和，无累加误差）
+    page_ids = []
     costs = []
+    current = []
     for pg in pages:
         props = pg.get("properties") or {}
         c = prop_number_value(props.get(COST_FIELD))
         if c is not None:
-            costs.append((pg["id"], float(c)))
-    total_cost = sum(v for _, v in costs)
+            page_ids.append(pg["id"])
+            costs.append(float(c))
+            current.append(props.get(WEIGHT_FIELD))
+    total_cost = math.fsum(costs)
     print(f"[POSITION] total_cost={total_cost}")
     if total_cost <= 0:
         print("[POSITION] 总持仓成本<=0，跳过仓位写入。")
         return
 
-    # 2) 写回仓位（0~1）
-    updated = 0
-    for page_id, c in costs:
+    # 2) 写回仓位（0~1），仅写入有变化的页面，并发 PATCH
+    updates = []
+    for page_id, c, cur in zip(page_ids, costs, current):
         position = c / total_cost
-        try:
-            notion_request(
-                "PATCH",
-                f"/pages/{page_id}",
-                {"properties": {WEIGHT_FIELD: {"number": position}}},
-            )
+        if number_unchanged(cur, position):
+            continue
+        updates.append((page_id, {WEIGHT_FIELD: {"number": position}}))
+    updated = 0
+    for (page_id, _), res in zip(updates, notion_patch_pages(updates)):
+        if isinstance(res, Exception):
+            print(f"[ERR] POSITION {page_id}: {res}")
+        else:
             updated += 1
-        except Exception as exc:
-            print(f"[ERR] POSITION {page_id}: {exc}")
-    print(f"[POSITION] updated={updated}/{len(costs)}")
+    print(
+        f"[POSITION] updated={updated}/{len(updates)}, "
+        f"unchanged={len(page_ids) - len(updates)}"
+    )
 
 
 # ================== main：link / market / position / all ==================
@@ -721,9 +1044,9 @@ def main() -> None:
         update_holdings_market()
     if mode in ("position", "all"):
         update_positions_by_cost()
-    # 所有模式都包含费率计算
+    # 所有模式都包含费率计算；未刷新行情的模式只需补算缺失/新编辑的交易
     if TRADES_DB_ID:
-        update_all_trades_estimated_fees()
+        update_all_trades_estimated_fees(only_stale=mode in ("link", "position"))
     else:
         print("[WARN] 未设置 TRADES_DB_ID，跳过费率计算")
 